@@ -1,10 +1,27 @@
 # backend/app.py
 import os
 import sys
-from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory, abort
+import hmac
+import hashlib
+import secrets
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from flask import Flask, request, jsonify, abort, g
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from flask_compress import Compress
+import orjson
+import ciso8601
+from werkzeug.security import check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from sqlalchemy import event, select, func, inspect, text, update, case, bindparam
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
 
 # Import db and models from models.py (same folder)
 from models import db, User, Product, Transaction, TransactionLine
@@ -20,55 +37,264 @@ else:
 
 # static folder (where frontend build/files live)
 STATIC_FOLDER = os.path.join(BASE_DIR, 'static')
+# set OAKS_SERVE_STATIC=0 when a reverse proxy serves static/ (see docs/README.md);
+# Flask then only handles /api/*
+SERVE_STATIC = os.environ.get('OAKS_SERVE_STATIC', '1') != '0'
+
+# index.html is read once at startup (restart to pick up frontend changes); None when not serving static
+INDEX_PATH = os.path.join(STATIC_FOLDER, 'index.html')
+INDEX_BYTES = None
+if SERVE_STATIC and os.path.exists(INDEX_PATH):
+    with open(INDEX_PATH, 'rb') as f:
+        INDEX_BYTES = f.read()
+
+class ORJSONProvider(JSONProvider):
+    """jsonify / request.json backed by orjson (datetimes are serialized natively as ISO 8601)."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # same argument handling as jsonify(): one positional value, else the args list or the kwargs dict
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+        obj = args[0] if len(args) == 1 else (args or kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
 
 app = Flask(
     __name__,
-    static_folder=STATIC_FOLDER,
+    static_folder=STATIC_FOLDER if SERVE_STATIC else None,
     static_url_path=''  # serve static files at root
 )
+app.json = ORJSONProvider(app)
+# number of reverse proxies in front of the app (nginx, a PaaS router, ...). When set, the client
+# address is taken from X-Forwarded-For so rate limits apply per client rather than per proxy.
+OAKS_PROXY_HOPS = int(os.environ.get('OAKS_PROXY_HOPS', '0'))
+if OAKS_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=OAKS_PROXY_HOPS)
 app.config['SQLALCHEMY_DATABASE_URI'] = DB_PATH
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+if DB_PATH not in ('sqlite://', 'sqlite:///:memory:'):
+    # in-memory SQLite uses a static pool that doesn't take sizing options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(pool_size=10, max_overflow=20)
+
+# brotli/gzip for JSON and static assets, picked from Accept-Encoding
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+Compress(app)
 
 # Allow cross-origin during development; in production, restrict origins if needed
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+def rate_limit_key():
+    """Client address plus the user whose PIN is being checked: admin_name when admin_pin is sent, else name."""
+    if request.method == 'GET':
+        fields = request.args
+    else:
+        body = parsed_body()
+        fields = body if isinstance(body, dict) else {}
+    name = fields.get('admin_name') if 'admin_pin' in fields else fields.get('name')
+    return f"{request.remote_addr}:{name or ''}"
+
+# per client+name limits on auth endpoints; set RATELIMIT_STORAGE_URI (e.g. redis://...) when running several workers
+limiter = Limiter(rate_limit_key, app=app, storage_uri=os.environ.get('RATELIMIT_STORAGE_URI', 'memory://'))
+# plus one budget per client address shared by all auth endpoints, so a client can't spread guesses over many names
+auth_per_address = limiter.shared_limit('30/minute', scope='auth-address', key_func=get_remote_address)
+
+# Argon2id for PIN hashes (64 MiB, 3 passes, 2 lanes)
+pin_hasher = PasswordHasher(memory_cost=65536, time_cost=3, parallelism=2)
+
 # initialize db with app
 db.init_app(app)
 
-# create tables and default admin (only inside app context)
-with app.app_context():
-    db.create_all()
-    # admin PIN can be set via ADMIN_PIN environment variable for initial bootstrapping
-    admin_pin = os.environ.get('ADMIN_PIN', '1234')
-    if not User.query.first():
-        admin = User(name='admin', pin_hash=generate_password_hash(admin_pin), is_admin=True)
-        db.session.add(admin)
-        db.session.commit()
-        print(f'Created default admin user with name "admin" and PIN "{admin_pin}". Change this immediately!', file=sys.stderr)
+# SQLite tuning: WAL lets readers proceed while a writer commits, and
+# synchronous=NORMAL is safe under WAL while avoiding an fsync per commit.
+if DB_PATH.startswith('sqlite'):
+    @event.listens_for(Engine, 'connect')
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # stop pysqlite from issuing its own BEGIN/COMMIT; _sqlite_begin below emits BEGIN instead,
+        # so SAVEPOINTs nest inside the session's transaction rather than committing on RELEASE
+        dbapi_conn.isolation_level = None
+        cur = dbapi_conn.cursor()
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA synchronous=NORMAL')
+        cur.execute('PRAGMA temp_store=MEMORY')
+        cur.execute('PRAGMA mmap_size=268435456')
+        cur.close()
+
+    @event.listens_for(Engine, 'begin')
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql('BEGIN')
 
 # -------------------------
 # Helper utilities
 # -------------------------
+def hash_pin(pin):
+    return pin_hasher.hash(pin)
+
+def verify_pin(user, pin):
+    """Check pin against user's stored hash. Legacy werkzeug hashes are upgraded to Argon2 on success."""
+    if user.pin_hash.startswith('$argon2'):
+        try:
+            pin_hasher.verify(user.pin_hash, pin)
+        except (VerificationError, InvalidHashError):
+            return False
+        if pin_hasher.check_needs_rehash(user.pin_hash):
+            user.pin_hash = hash_pin(pin)
+            db.session.commit()
+        return True
+    if check_password_hash(user.pin_hash, pin):
+        user.pin_hash = hash_pin(pin)
+        db.session.commit()
+        return True
+    return False
+
+def parsed_body():
+    """JSON request body, parsed once per request with orjson. Empty bodies give {}."""
+    body = getattr(g, '_body', None)
+    if body is None:
+        try:
+            body = orjson.loads(request.get_data() or b'{}') or {}
+        except orjson.JSONDecodeError:
+            abort(400)
+        g._body = body
+    return body
+
+def parse_dt(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime; None if missing or invalid."""
+    if not value:
+        return None
+    try:
+        dt = ciso8601.parse_datetime(value)
+    except (ValueError, TypeError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def get_user(name):
+    return db.session.execute(select(User).where(User.name == name)).scalar_one_or_none()
+
+# verified against when the user doesn't exist, so unknown names cost the same as wrong PINs
+DUMMY_HASH = hash_pin('invalid')
+
+# failed attempts per name: {name: (count, first_failure_ts, last_failure_ts)}, forgotten after FAILURE_WINDOW seconds
+FAILURE_WINDOW = 15 * 60
+_failed_logins = {}
+
+def backoff_remaining(name):
+    """Seconds until name may be tried again: 100ms * 2^(failures-1) after the last failure, max 2s."""
+    entry = _failed_logins.get(name)
+    if not entry:
+        return 0
+    count, _, last = entry
+    return max(0, last + min(2, 0.1 * 2 ** (count - 1)) - time.time())
+
+def record_failure(name):
+    now = time.time()
+    count, first, _ = _failed_logins.get(name, (0, now, now))
+    if now - first > FAILURE_WINDOW:
+        count, first = 0, now
+    _failed_logins[name] = (count + 1, first, now)
+    if len(_failed_logins) > 10000:
+        for key, (_, ts, _) in list(_failed_logins.items()):
+            if now - ts > FAILURE_WINDOW:
+                _failed_logins.pop(key, None)
+
+def authenticate(name, pin):
+    """Return the user matching (name,pin) or None. Always performs one hash verification.
+    Aborts with 429 while name is backing off from earlier failures."""
+    if backoff_remaining(name) > 0:
+        abort(429)
+    user = get_user(name)
+    if not user:
+        try:
+            pin_hasher.verify(DUMMY_HASH, pin)
+        except VerificationError:
+            pass
+    elif verify_pin(user, pin):
+        _failed_logins.pop(name, None)
+        return user
+    record_failure(name)
+    return None
+
+# recently verified admin credentials: {(name, keyed pin digest): (user_id, expiry)}.
+# The digest key is random per process, so cached entries can't be brute-forced back to PINs.
+ADMIN_CACHE_TTL = 30
+_admin_cache = {}
+_admin_cache_key = secrets.token_bytes(32)
+
+def _pin_digest(pin):
+    return hashlib.blake2b(pin.encode(), key=_admin_cache_key, digest_size=16).hexdigest()
+
+def forget_admin(name):
+    """Drop cached verifications for name (call whenever its PIN changes)."""
+    for key in [k for k in _admin_cache if k[0] == name]:
+        _admin_cache.pop(key, None)
+
 def require_admin(name, pin):
     """Verify that (name,pin) belongs to an admin user. Returns user or None."""
     if not name or not pin:
         return None
-    user = User.query.filter_by(name=name).first()
-    if not user:
-        return None
-    if check_password_hash(user.pin_hash, pin) and user.is_admin:
+    now = time.monotonic()
+    key = (name, _pin_digest(pin))
+    cached = _admin_cache.get(key)
+    if cached and cached[1] > now:
+        user = db.session.get(User, cached[0])
+        if user and user.is_admin:
+            return user
+        _admin_cache.pop(key, None)
+
+    user = authenticate(name, pin)
+    if user and hmac.compare_digest(str(bool(user.is_admin)), 'True'):
+        if len(_admin_cache) > 1000:
+            for k, (_, expiry) in list(_admin_cache.items()):
+                if expiry <= now:
+                    _admin_cache.pop(k, None)
+        _admin_cache[key] = (user.id, now + ADMIN_CACHE_TTL)
         return user
     return None
 
+# create tables and default admin (only inside app context)
+with app.app_context():
+    db.create_all()
+    # create_all skips tables that already exist: add product.updated_at to databases created before it,
+    # and any indexes the tables are missing
+    if 'updated_at' not in {c['name'] for c in inspect(db.engine).get_columns('product')}:
+        col_type = Product.__table__.c.updated_at.type.compile(dialect=db.engine.dialect)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE product ADD COLUMN updated_at {col_type}'))
+        except DBAPIError:
+            # another worker may have added it first
+            if 'updated_at' not in {c['name'] for c in inspect(db.engine).get_columns('product')}:
+                raise
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except DBAPIError:
+                # another worker may have created it between the check and the CREATE
+                if index.name not in {i['name'] for i in inspect(db.engine).get_indexes(table.name)}:
+                    raise
+    # admin PIN can be set via ADMIN_PIN environment variable for initial bootstrapping
+    admin_pin = os.environ.get('ADMIN_PIN', '1234')
+    if not db.session.query(User.id).first():
+        admin = User(name='admin', pin_hash=hash_pin(admin_pin), is_admin=True)
+        db.session.add(admin)
+        db.session.commit()
+        print(f'Created default admin user with name "admin" and PIN "{admin_pin}". Change this immediately!', file=sys.stderr)
+
 # -------------------------
 # Serve frontend (SPA)
 # -------------------------
 @app.route('/', methods=['GET'])
 def serve_index():
     # Serve index.html from static folder
-    index_path = os.path.join(app.static_folder, 'index.html')
-    if os.path.exists(index_path):
-        return send_from_directory(app.static_folder, 'index.html')
+    if INDEX_BYTES:
+        return app.response_class(INDEX_BYTES, mimetype='text/html')
     return jsonify({'app': 'oaks-mart-backend', 'status': 'no-static-found', 'db': DB_PATH})
 
 # Ensure service worker, manifest, JS, CSS are served normally by static route.
@@ -85,13 +311,15 @@ def health():
 # Auth endpoints
 # -------------------------
 @app.route('/api/auth/create_user', methods=['POST'])
+@limiter.limit('10/minute')
+@auth_per_address
 def create_user():
     """
     Create a new user on the server.
     JSON: { name, pin, is_admin (optional), admin_name, admin_pin }
     Requires an admin (admin_name/admin_pin) to authorize creation on server.
     """
-    data = request.json or {}
+    data = parsed_body()
     name = (data.get('name') or '').strip()
     pin = (data.get('pin') or '').strip()
     is_admin = bool(data.get('is_admin', False))
@@ -107,40 +335,44 @@ def create_user():
     if not name or not pin:
         return jsonify({'ok': False, 'error': 'name and pin required'}), 400
 
-    if User.query.filter_by(name=name).first():
+    if get_user(name):
         return jsonify({'ok': False, 'error': 'user already exists'}), 400
 
-    user = User(name=name, pin_hash=generate_password_hash(pin), is_admin=is_admin)
+    user = User(name=name, pin_hash=hash_pin(pin), is_admin=is_admin)
     db.session.add(user)
     db.session.commit()
     return jsonify({'ok': True, 'user': user.to_dict()})
 
 @app.route('/api/auth/login', methods=['POST'])
+@limiter.limit('10/minute')
+@auth_per_address
 def login():
     """
     Login using name and pin.
     JSON: { name, pin }
     Returns user details if ok (no token for now; can be extended)
     """
-    data = request.json or {}
+    data = parsed_body()
     name = (data.get('name') or '').strip()
     pin = (data.get('pin') or '').strip()
     if not name or not pin:
         return jsonify({'ok': False, 'error': 'name and pin required'}), 400
 
-    user = User.query.filter_by(name=name).first()
-    if user and check_password_hash(user.pin_hash, pin):
+    user = authenticate(name, pin)
+    if user:
         return jsonify({'ok': True, 'user': user.to_dict()})
     return jsonify({'ok': False, 'error': 'invalid credentials'}), 401
 
 @app.route('/api/auth/change_pin', methods=['POST'])
+@limiter.limit('10/minute')
+@auth_per_address
 def change_pin():
     """
     Change a user's PIN on the server.
     JSON: { target_name, new_pin, admin_name, admin_pin }
     Admin credentials required.
     """
-    data = request.json or {}
+    data = parsed_body()
     target_name = (data.get('target_name') or '').strip()
     new_pin = (data.get('new_pin') or '').strip()
     admin_name = data.get('admin_name')
@@ -152,15 +384,21 @@ def change_pin():
     if not require_admin(admin_name, admin_pin):
         return jsonify({'ok': False, 'error': 'admin auth failed'}), 403
 
-    user = User.query.filter_by(name=target_name).first()
+    user = get_user(target_name)
     if not user:
         return jsonify({'ok': False, 'error': 'target user not found'}), 404
 
-    user.pin_hash = generate_password_hash(new_pin)
+    user.pin_hash = hash_pin(new_pin)
     db.session.commit()
+    forget_admin(user.name)
     return jsonify({'ok': True, 'user': user.to_dict()})
 
+# columns returned by GET /api/users, matching User.to_dict()
+USER_COLS = (User.id, User.name, User.is_admin, User.created_at)
+
 @app.route('/api/users', methods=['GET'])
+@limiter.limit('10/minute')
+@auth_per_address
 def list_users():
     """
     List users (admin-only). Query params accepted: admin_name, admin_pin (simple approach).
@@ -169,16 +407,46 @@ def list_users():
     admin_pin = request.args.get('admin_pin')
     if not admin_name or not admin_pin or not require_admin(admin_name, admin_pin):
         return jsonify({'ok': False, 'error': 'admin auth required'}), 403
-    users = User.query.all()
-    return jsonify({'ok': True, 'users': [u.to_dict() for u in users]})
+    rows = db.session.execute(select(*USER_COLS)).mappings()
+    return jsonify({'ok': True, 'users': [dict(r) for r in rows]})
 
 # -------------------------
 # Product endpoints
 # -------------------------
+# columns returned by GET /api/products, matching Product.to_dict(); read as plain rows, no ORM objects
+PRODUCT_COLS = (Product.id, Product.barcode, Product.name, Product.price, Product.cost,
+                Product.qty, Product.is_new, Product.created_at)
+
+# in-process cache of the serialized product list, revalidated against the table every PRODUCTS_TTL seconds
+PRODUCTS_TTL = 5
+_products_cache = {'etag': None, 'last_modified': None, 'body': None, 'at': 0}
+
+def products_version():
+    """Cheap fingerprint of the product table: (etag from row count plus latest update, latest update)."""
+    count, last = db.session.query(func.count(Product.id), func.max(Product.updated_at)).one()
+    return hashlib.md5(f'{count}:{last}'.encode()).hexdigest(), last
+
+def invalidate_products_cache():
+    _products_cache['at'] = 0
+
 @app.route('/api/products', methods=['GET'])
 def get_products():
-    prods = Product.query.order_by(Product.name).all()
-    return jsonify([p.to_dict() for p in prods])
+    now = time.monotonic()
+    if _products_cache['body'] is None or now - _products_cache['at'] > PRODUCTS_TTL:
+        etag, last_modified = products_version()
+        if etag != _products_cache['etag'] or _products_cache['body'] is None:
+            rows = db.session.execute(select(*PRODUCT_COLS).order_by(Product.name)).mappings()
+            _products_cache['body'] = orjson.dumps([dict(r) for r in rows])
+            _products_cache['etag'] = etag
+            _products_cache['last_modified'] = last_modified
+        _products_cache['at'] = now
+
+    resp = app.response_class(_products_cache['body'], mimetype='application/json')
+    resp.set_etag(_products_cache['etag'])
+    if _products_cache['last_modified']:
+        resp.last_modified = _products_cache['last_modified']
+    resp.headers['Cache-Control'] = f'public, max-age={PRODUCTS_TTL}'
+    return resp.make_conditional(request)
 
 @app.route('/api/products', methods=['POST'])
 def create_or_update_product():
@@ -186,7 +454,7 @@ def create_or_update_product():
     Create or update product by barcode.
     JSON: { barcode, name, price, cost, qty, is_new, admin_name, admin_pin }
     """
-    data = request.json or {}
+    data = parsed_body()
     barcode = (data.get('barcode') or '').strip()
     if not barcode:
         return jsonify({'ok': False, 'error': 'barcode required'}), 400
@@ -203,98 +471,140 @@ def create_or_update_product():
     if 'is_new' in data: product.is_new = bool(data.get('is_new'))
 
     db.session.commit()
+    invalidate_products_cache()
     return jsonify({'ok': True, 'product': product.to_dict()})
 
 # -------------------------
 # Sync endpoint
 # -------------------------
+INT64_MAX = 2 ** 63 - 1
+
 @app.route('/api/sync', methods=['POST'])
 def sync_transactions():
     """
     Accepts: { transactions: [ { local_id, createdAt, total, payment_type, lines: [{barcode,name,qty,price,cost}] }, ... ] }
     Returns: { ok: True, ack: [ { local_id, status, server_id? , error? } ... ], updated_products: [...] }
     """
-    payload = request.json or {}
+    payload = parsed_body()
     txs = payload.get('transactions', [])
     ack = []
-    updated_products = {}
+    qty_deltas = defaultdict(int)  # barcode -> total qty sold across the payload
 
+    # one outer commit for the whole batch; each tx gets a savepoint so a bad
+    # tx only rolls back its own rows
     for tx in txs:
         local_id = tx.get('local_id')
         try:
-            total = float(tx.get('total', 0))
-            payment_type = tx.get('payment_type', 'cash')
-            created_at = None
-            if tx.get('createdAt'):
-                try:
-                    created_at = datetime.fromisoformat(tx['createdAt'])
-                except Exception:
-                    created_at = datetime.utcnow()
-            t = Transaction(total=total, payment_type=payment_type, synced=True, created_at=created_at or datetime.utcnow())
-            db.session.add(t)
-            db.session.flush()  # get t.id
-
-            # store lines
-            for line in tx.get('lines', []):
-                l = TransactionLine(transaction_id=t.id,
-                                    barcode=line.get('barcode'),
-                                    name=line.get('name'),
-                                    qty=int(line.get('qty', 0)),
-                                    price=float(line.get('price', 0)),
-                                    cost=float(line.get('cost', 0)))
-                db.session.add(l)
-
-                # adjust product qty on server if product exists
-                prod = Product.query.filter_by(barcode=line.get('barcode')).first()
-                if prod:
-                    prod.qty = max(0, (prod.qty or 0) - l.qty)
-                    updated_products[prod.barcode] = prod.to_dict()
-
-            db.session.commit()
+            with db.session.begin_nested():
+                total = float(tx.get('total', 0))
+                payment_type = tx.get('payment_type', 'cash')
+                created_at = parse_dt(tx.get('createdAt')) or datetime.utcnow()
+                t = Transaction(total=total, payment_type=payment_type, synced=True, created_at=created_at)
+                db.session.add(t)
+                db.session.flush()  # get t.id
+
+                # lines are written inside the savepoint; stock adjustments are collected and applied after the loop
+                tx_lines = []
+                tx_deltas = defaultdict(int)
+                for line in tx.get('lines', []):
+                    qty = int(line.get('qty', 0))
+                    barcode = line.get('barcode')
+                    if barcode is not None and not isinstance(barcode, str):
+                        raise ValueError('barcode must be a string')
+                    tx_lines.append({'transaction_id': t.id,
+                                     'barcode': barcode,
+                                     'name': line.get('name'),
+                                     'qty': qty,
+                                     'price': float(line.get('price', 0)),
+                                     'cost': float(line.get('cost', 0))})
+
+                    if barcode is not None:
+                        tx_deltas[barcode] += qty
+                if tx_lines:
+                    db.session.bulk_insert_mappings(TransactionLine, tx_lines)
+
+            # only reached once the savepoint is released, so these belong to a kept transaction
+            for barcode, qty in tx_deltas.items():
+                qty_deltas[barcode] += qty
             ack.append({'local_id': local_id, 'status': 'ok', 'server_id': t.id})
         except Exception as e:
-            db.session.rollback()
             ack.append({'local_id': local_id, 'status': 'error', 'error': str(e)})
 
-    return jsonify({'ok': True, 'ack': ack, 'updated_products': list(updated_products.values())})
+    updated_products = []
+    try:
+        if qty_deltas:
+            # adjust product qty on server (never below zero) for products that exist,
+            # one parameter set per barcode
+            new_qty = func.coalesce(Product.qty, 0) - bindparam('d')
+            stmt = (update(Product.__table__)
+                    .where(Product.barcode == bindparam('b'))
+                    .values(qty=case((new_qty < 0, 0), else_=new_qty)))
+            # per-line qtys were range-checked by the inserts; clamp the sums to SQLite's 64-bit range
+            db.session.execute(stmt, [{'b': b, 'd': max(-INT64_MAX, min(INT64_MAX, d))} for b, d in qty_deltas.items()])
+        db.session.commit()
+        if qty_deltas:
+            updated_products = Product.query.filter(Product.barcode.in_(list(qty_deltas))).all()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': str(e)}), 500
+    if updated_products:
+        invalidate_products_cache()
+
+    return jsonify({'ok': True, 'ack': ack, 'updated_products': [p.to_dict() for p in updated_products]})
 
 # -------------------------
 # AI stub endpoint
 # -------------------------
+MAX_LOOKBACK_DAYS = 3650
+
 @app.route('/api/ai/suggest', methods=['POST'])
 def ai_suggest():
     """
     Basic heuristic-based suggestions for a product.
-    Accepts: { barcode: '...', lookback_days: 14 }
+    Accepts: { barcode: '...', lookback_days: 14 }  (lookback_days is clamped to 1..3650)
     Returns basic metrics and suggestions.
     """
-    data = request.json or {}
+    data = parsed_body()
     barcode = (data.get('barcode') or '').strip()
-    lookback_days = int(data.get('lookback_days', 14))
+    try:
+        lookback_days = int(data.get('lookback_days', 14))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'ok': False, 'error': 'lookback_days must be an integer'}), 400
+    lookback_days = max(1, min(MAX_LOOKBACK_DAYS, lookback_days))
 
     if not barcode:
         return jsonify({'ok': False, 'error': 'barcode required'}), 400
 
-    prod = Product.query.filter_by(barcode=barcode).first()
-    if not prod:
+    # product row and sold qty within the lookback window in one round trip
+    since = datetime.utcnow() - timedelta(days=lookback_days)
+    sold = (select(func.coalesce(func.sum(TransactionLine.qty), 0))
+            .select_from(TransactionLine)
+            .join(Transaction)
+            .where(TransactionLine.barcode == barcode, Transaction.created_at >= since)
+            .scalar_subquery())
+    row = db.session.execute(
+        select(*PRODUCT_COLS, sold.label('total_sold')).where(Product.barcode == barcode)
+    ).mappings().first()
+    if not row:
         return jsonify({'ok': False, 'error': 'product not found'}), 404
 
-    # compute sold qty (simple across all history)
-    lines = TransactionLine.query.filter_by(barcode=barcode).all()
-    total_sold = sum(l.qty for l in lines)
-    avg_daily = total_sold / max(1, lookback_days)
+    prod = {col.key: row[col.key] for col in PRODUCT_COLS}
+    qty = prod['qty'] or 0
+    price, cost = prod['price'], prod['cost']
+    total_sold = row['total_sold']
+    avg_daily = total_sold / lookback_days
 
     suggested_reorder = 0
-    days_of_cover = float('inf') if avg_daily == 0 else prod.qty / avg_daily
+    days_of_cover = float('inf') if avg_daily == 0 else qty / avg_daily
     if avg_daily > 0:
         target = max(int(avg_daily * 14), 5)
-        suggested_reorder = max(0, target - prod.qty)
+        suggested_reorder = max(0, target - qty)
 
     margin = None
     margin_pct = None
-    if prod.price is not None and prod.cost is not None:
-        margin = prod.price - prod.cost
-        margin_pct = (margin / prod.price * 100) if prod.price else 0
+    if price is not None and cost is not None:
+        margin = price - cost
+        margin_pct = (margin / price * 100) if price else 0
 
     research = [
         {'type': 'placeholder', 'note': 'Competitor pricing research / supplier ETA not implemented in stub.'}
@@ -302,9 +612,10 @@ def ai_suggest():
 
     resp = {
         'ok': True,
-        'product': prod.to_dict(),
+        'product': prod,
         'metrics': {
-            'total_sold_in_history': total_sold,
+            'total_sold_in_window': total_sold,
+            'lookback_days': lookback_days,
             'avg_daily_estimate': avg_daily,
             'days_of_cover': None if days_of_cover == float('inf') else round(days_of_cover, 1)
         },
@@ -318,15 +629,18 @@ def ai_suggest():
     }
     return jsonify(resp)
 
+@app.errorhandler(429)
+def too_many_attempts(err):
+    return jsonify({'ok': False, 'error': 'too many attempts, try again shortly'}), 429
+
 # -------------------------
 # Fallback for SPA paths (serve index.html)
 # -------------------------
 @app.errorhandler(404)
 def spa_fallback(err):
     """If a static file wasn't found, return index.html so SPA client-router can handle routes."""
-    index_path = os.path.join(app.static_folder, 'index.html')
-    if os.path.exists(index_path):
-        return send_from_directory(app.static_folder, 'index.html')
+    if INDEX_BYTES:
+        return app.response_class(INDEX_BYTES, mimetype='text/html')
     return jsonify({'error': 'not found'}), 404
 
 # -------------------------
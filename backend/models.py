@@ -17,7 +17,7 @@ class User(db.Model):
             'id': self.id,
             'name': self.name,
             'is_admin': self.is_admin,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at
         }
 
 class Product(db.Model):
@@ -30,6 +30,7 @@ class Product(db.Model):
     qty = db.Column(db.Integer, default=0)
     is_new = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
         return {
@@ -40,22 +41,22 @@ class Product(db.Model):
             'cost': self.cost,
             'qty': self.qty,
             'is_new': self.is_new,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at
         }
 
 class Transaction(db.Model):
     __tablename__ = 'transaction'
     id = db.Column(db.Integer, primary_key=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     total = db.Column(db.Float)
     payment_type = db.Column(db.String(50))
     synced = db.Column(db.Boolean, default=False)
-    lines = db.relationship('TransactionLine', backref='transaction', lazy=True, cascade='all, delete-orphan')
+    lines = db.relationship('TransactionLine', backref='transaction', lazy='selectin', cascade='all, delete-orphan')
 
     def to_dict(self):
         return {
             'id': self.id,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at,
             'total': self.total,
             'payment_type': self.payment_type,
             'synced': self.synced,
@@ -64,6 +65,7 @@ class Transaction(db.Model):
 
 class TransactionLine(db.Model):
     __tablename__ = 'transaction_line'
+    __table_args__ = (db.Index('ix_txline_barcode_tx', 'barcode', 'transaction_id'),)
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=False)
     barcode = db.Column(db.String(120))
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['OAKS_DB'] = 'sqlite:///' + DB_FILE
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from app import app, db
+from models import Product, Transaction, TransactionLine
+
+
+def test_sync_failure_after_savepoints_leaves_no_transactions():
+    """A failing stock UPDATE must roll back the transactions written by the earlier savepoints."""
+    client = app.test_client()
+    client.post('/api/products', json={'barcode': 'T1', 'name': 'Tea', 'price': 10, 'cost': 5, 'qty': 10})
+
+    def fail_stock_update(conn, cursor, statement, *args):
+        if statement.startswith('UPDATE product'):
+            raise RuntimeError('stock update failed')
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', fail_stock_update)
+    try:
+        resp = client.post('/api/sync', json={'transactions': [
+            {'local_id': 1, 'total': 10, 'lines': [{'barcode': 'T1', 'qty': 1}]},
+            {'local_id': 2, 'total': 20, 'lines': [{'barcode': 'T1', 'qty': 2}]},
+        ]})
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', fail_stock_update)
+
+    assert resp.status_code == 500
+    with app.app_context():
+        assert Transaction.query.count() == 0
+        assert TransactionLine.query.count() == 0
+        assert Product.query.filter_by(barcode='T1').one().qty == 10
+
+
+def test_sync_stock_update_shares_transaction_with_inserts():
+    """The coalesced stock UPDATE runs before anything from the batch is visible to other connections."""
+    client = app.test_client()
+    client.post('/api/products', json={'barcode': 'T2', 'name': 'Sugar', 'price': 10, 'cost': 5, 'qty': 10})
+    with app.app_context():
+        before = Transaction.query.count()
+    seen = []
+
+    def count_committed(conn, cursor, statement, *args):
+        if statement.startswith('UPDATE product'):
+            other = sqlite3.connect(DB_FILE)
+            seen.append(other.execute('SELECT count(*) FROM "transaction"').fetchone()[0])
+            other.close()
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_committed)
+    try:
+        resp = client.post('/api/sync', json={'transactions': [
+            {'local_id': 1, 'total': 10, 'lines': [{'barcode': 'T2', 'qty': 1}]},
+            {'local_id': 2, 'total': 20, 'lines': [{'barcode': 'T2', 'qty': 2}]},
+        ]})
+    finally:
+        with app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', count_committed)
+
+    assert resp.status_code == 200
+    assert seen == [before]
+    with app.app_context():
+        assert Transaction.query.count() == before + 2
+        assert Product.query.filter_by(barcode='T2').one().qty == 7